@@ -1,20 +1,29 @@
 # app.py
 import os
-from typing import Optional, Dict, Any, List
+import asyncio
+import base64
+import datetime
+import decimal
+import functools
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+from typing import Optional, Dict, Any, List, Tuple, Callable
 
 import httpx
-from fastapi import FastAPI, Request, Query, HTTPException
-from fastapi.responses import JSONResponse, FileResponse
+import orjson
+import pyarrow as pa
+from cachetools import TTLCache
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import JSONResponse, FileResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from starlette.middleware.gzip import GZipMiddleware
 
 # Databricks SQL connector (PEP 249)
 from databricks import sql as dbsql
 
-# Databricks workspace client (used for /api/me in local PAT mode)
-from databricks.sdk import WorkspaceClient
-from databricks.sdk.core import Config
-
 # -------------------------------------------------------------------
 # LOCAL DEV ONLY: load .env (ignored in Databricks Apps runtime)
 # -------------------------------------------------------------------
@@ -30,18 +39,63 @@ try:
 except:
     np = None
 
+# Optional: zstd / brotli / gzip negotiation (falls back to gzip only)
+try:
+    from starlette_compress import CompressMiddleware, add_compress_type
+except:
+    CompressMiddleware = None
+
 # -------------------------------------------------------------------
-# Create app, enable gzip, and serve static files for UI
+# Logging: %-style args are only formatted if the record is emitted.
+# A `uvicorn --log-config` that defines the "argus" logger wins; otherwise
+# log to stderr, level-aligned like uvicorn's own lines.
+# -------------------------------------------------------------------
+logger = logging.getLogger("argus")
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(levelname)-9s %(name)s %(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(os.getenv("ARGUS_LOG_LEVEL", "INFO").upper())
+    logger.propagate = False
+
+# -------------------------------------------------------------------
+# Create app, enable compression, and serve static files for UI
 # -------------------------------------------------------------------
 app = FastAPI()
 
-# Compress large responses to avoid blowing up browser memory
-app.add_middleware(GZipMiddleware, minimum_size=1024)
+# Compress large responses to avoid blowing up browser memory.
+# Level 5 is ~half the CPU of the default 9 for a few % larger JSON; tiny
+# payloads (/api/me, /api/sql/ping, /api/debug/env) aren't worth compressing.
+# zstd / brotli beat gzip on the text-heavy /api/emails rows for clients that
+# advertise them. Keep compression the LAST middleware added (= outermost) so
+# anything else runs before the body is rewritten.
+if CompressMiddleware is not None:
+    add_compress_type("application/x-ndjson", streaming=True)
+    add_compress_type("application/vnd.apache.arrow.stream")
+    app.add_middleware(CompressMiddleware, minimum_size=2048, zstd_level=4, brotli_quality=4, gzip_level=5)
+else:
+    app.add_middleware(GZipMiddleware, minimum_size=2048, compresslevel=5)
 
 # Serve ./static/* at /static/*
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 
+# One pooled HTTP client for workspace REST calls — reuses TCP/TLS
+# connections instead of a fresh handshake per request.
+@app.on_event("startup")
+async def _init_http():
+    app.state.http = httpx.AsyncClient(
+        timeout=httpx.Timeout(15.0, connect=5.0),
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=30),
+        http2=True,
+    )
+
+
+@app.on_event("shutdown")
+async def _close_http():
+    await app.state.http.aclose()
+
+
 # ===================================================================
 # CORE AUTH + CONFIG HELPERS
 # ===================================================================
@@ -73,6 +127,23 @@ def _http_path() -> str:
     return p
 
 
+@app.on_event("startup")
+def _resolve_config():
+    """
+    Resolve workspace config ONCE (fails startup on misconfig) into
+    `app.state.databricks`:
+    - host_url:  https://<workspace>  (REST calls)
+    - hostname:  <workspace>          (SQL connector)
+    - http_path: SQL Warehouse HTTP Path
+    """
+    host_url = _host()
+    app.state.databricks = SimpleNamespace(
+        host_url=host_url,
+        hostname=host_url.replace("https://", "").replace("http://", ""),
+        http_path=_http_path(),
+    )
+
+
 def _token(req: Request) -> Dict[str, Any]:
     """
     Returns **how to authenticate**:
@@ -93,58 +164,389 @@ def _token(req: Request) -> Dict[str, Any]:
 
 async def _get_json(host: str, token: str, path: str) -> Optional[dict]:
     """
-    Helper for calling REST APIs — used for `/api/me` when in OBO mode.
+    Helper for calling REST APIs — used for `/api/me` (OBO token or local PAT).
+    Goes through the shared `app.state.http` client (keep-alive, HTTP/2).
     """
     url = f"{host.rstrip('/')}{path}"
     headers = {"Authorization": f"Bearer {token}"}
-    async with httpx.AsyncClient(timeout=15) as client:
-        resp = await client.get(url, headers=headers)
-        try:
-            return resp.json()
-        except:
-            return {"status": resp.status_code, "text": resp.text}
+    resp = await app.state.http.get(url, headers=headers)
+    try:
+        return resp.json()
+    except:
+        return {"status": resp.status_code, "text": resp.text}
+
+
+# In order of preference: SCIM `Me` is the shape the UI renders
+# (userName / displayName / emails / active); IAM is the fallback.
+ME_PATHS = ("/api/2.0/preview/scim/v2/Me", "/api/2.0/preview/iam/current-user")
+
+
+def _looks_like_user(payload) -> bool:
+    return isinstance(payload, dict) and bool(payload.get("userName") or payload.get("id"))
+
+
+async def _current_user(host: str, token: str) -> Optional[dict]:
+    """
+    Probe every `ME_PATHS` endpoint concurrently, but take results in
+    preference order: the first one that looks like a user wins and the
+    rest are cancelled — so a failing SCIM call costs no extra round trip.
+    If none looks like a user, return the first non-empty payload (e.g. an
+    error body); if every probe raised, re-raise the first error. Each probe
+    is bounded by the shared HTTP client's timeout.
+    """
+    tasks = [asyncio.create_task(_get_json(host, token, p)) for p in ME_PATHS]
+    fallback, error = None, None
+    try:
+        for task in tasks:
+            try:
+                payload = await task
+            except Exception as e:
+                error = error or e
+                continue
+            if _looks_like_user(payload):
+                return payload
+            fallback = fallback or payload
+    finally:
+        for task in tasks:
+            task.cancel()
+    if fallback is None and error is not None:
+        raise error
+    return fallback
+
+
+def _bytes_to_str(x) -> str:
+    # bytes → try utf8, else hex
+    try:
+        return bytes(x).decode("utf-8")
+    except:
+        return bytes(x).hex()
+
+
+# Exact-type dispatch: one dict lookup per value instead of an isinstance
+# ladder. Subclasses (and numpy) miss here and take `_to_jsonable_slow`.
+_CONVERTERS: Dict[type, Callable[[Any], Any]] = {
+    decimal.Decimal: float,
+    datetime.datetime: datetime.datetime.isoformat,
+    datetime.date: datetime.date.isoformat,
+    datetime.time: datetime.time.isoformat,
+    bytes: _bytes_to_str,
+    bytearray: _bytes_to_str,
+    memoryview: _bytes_to_str,
+}
+
+# numpy scalars/arrays get exact-type entries too (only if numpy is
+# installed), so they never reach the isinstance ladder — and non-numpy
+# values never touch numpy at all.
+if np is not None:
+    _CONVERTERS.update({
+        np.bool_: bool,
+        np.ndarray: np.ndarray.tolist,
+        np.str_: str,
+        np.bytes_: _bytes_to_str,
+        np.datetime64: np.datetime64.item,
+        np.timedelta64: np.timedelta64.item,
+    })
+    for _t in (np.int8, np.int16, np.int32, np.int64, np.longlong,
+               np.uint8, np.uint16, np.uint32, np.uint64, np.ulonglong):
+        _CONVERTERS[_t] = int
+    for _t in (np.float16, np.float32, np.float64):
+        _CONVERTERS[_t] = float
 
 
 def to_jsonable(x):
     """
     Safely convert values from Databricks SQL driver to standard JSON types.
     Prevents browser crashes from binary / numpy / decimals.
+
+    Used as orjson's `default=` hook: orjson walks dicts/lists itself (in C)
+    and only calls this for leaf values it can't encode natively.
     """
-    # numpy scalars / arrays
-    if np is not None and isinstance(x, np.generic):
-        return x.item()
-    if np is not None and isinstance(x, np.ndarray):
-        return [to_jsonable(v) for v in x.tolist()]
+    fn = _CONVERTERS.get(type(x))
+    return fn(x) if fn is not None else _to_jsonable_slow(x)
+
 
+def _to_jsonable_slow(x):
+    """isinstance ladder for types not in `_CONVERTERS` (subclasses, rare numpy)."""
     # simple JSON-safe values
     if isinstance(x, (str, int, float, bool)) or x is None:
         return x
 
-    # dict
-    if isinstance(x, dict):
-        return {str(k): to_jsonable(v) for k, v in x.items()}
-
-    # lists/tuples
-    if isinstance(x, (list, tuple)):
-        return [to_jsonable(v) for v in x]
-
     # dates, decimals, times, etc
-    import datetime, decimal
     if isinstance(x, decimal.Decimal):
         return float(x)
     if isinstance(x, (datetime.datetime, datetime.date, datetime.time)):
         return x.isoformat()
 
-    # bytes → try utf8, else hex
     if isinstance(x, (bytes, bytearray, memoryview)):
-        try:
-            return bytes(x).decode("utf-8")
-        except:
-            return bytes(x).hex()
+        return _bytes_to_str(x)
+
+    # remaining numpy scalars / arrays (complex, longdouble, subclasses…)
+    if np is not None:
+        if isinstance(x, np.generic):
+            return x.item()
+        if isinstance(x, np.ndarray):
+            return x.tolist()
 
     # fallback: string representation
     return str(x)
 
+
+# orjson encodes dict/list/tuple/str/int/float/bool/None/datetime/date/time
+# and numpy natively; `to_jsonable` only sees what's left (Decimal, bytes…)
+ORJSON_OPTS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def dumps(obj) -> bytes:
+    return orjson.dumps(obj, default=to_jsonable, option=ORJSON_OPTS)
+
+# ===================================================================
+# SQL CONNECTION POOL
+# ===================================================================
+
+# Opening a dbsql connection costs a TLS handshake + warehouse session
+# setup (hundreds of ms). Keep connections open and hand them out per
+# request instead. Size the pool to the warehouse's concurrency.
+POOL_MIN_SIZE = int(os.getenv("DBSQL_POOL_MIN_SIZE", "2"))
+POOL_MAX_SIZE = int(os.getenv("DBSQL_POOL_MAX_SIZE", "10"))
+POOL_PING_INTERVAL_S = 60
+# Close connections that sat idle longer than this, even if still healthy —
+# otherwise every OBO user's pool keeps its warehouse sessions open forever.
+POOL_IDLE_MAX_S = int(os.getenv("DBSQL_POOL_IDLE_MAX_S", "300"))
+
+# Admission control across ALL pools/users: at most this many /api/emails
+# queries in flight (≈ warehouse clusters × concurrent queries per cluster);
+# the rest queue here instead of piling new sessions onto the warehouse.
+DBSQL_MAX_CONCURRENCY = int(os.getenv("DBSQL_MAX_CONCURRENCY", "10"))
+_SQL_SEM = asyncio.Semaphore(DBSQL_MAX_CONCURRENCY)
+
+# The dbsql driver is blocking — run it on its own threads so queries don't
+# stall the event loop or starve the default executor used elsewhere.
+# One executor serves every pool: up to DBSQL_MAX_CONCURRENCY /api/emails
+# queries (and their connects) hold a thread each, plus HEADROOM threads for
+# work outside `_SQL_SEM` — /api/sql/ping, the pinger's SELECT 1s, closes —
+# so health checks never queue behind a burst of queries. Raise
+# DBSQL_MAX_CONCURRENCY and the thread count follows; DBSQL_POOL_MAX_SIZE
+# only caps connections per user.
+DBSQL_EXECUTOR_HEADROOM = int(os.getenv("DBSQL_EXECUTOR_HEADROOM", "4"))
+_EXECUTOR = ThreadPoolExecutor(
+    max_workers=DBSQL_MAX_CONCURRENCY + DBSQL_EXECUTOR_HEADROOM,
+    thread_name_prefix="dbsql",
+)
+
+
+async def _in_sql_thread(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_EXECUTOR, fn, *args)
+
+
+def _close_quietly(conn) -> None:
+    try:
+        conn.close()
+    except:
+        pass
+
+
+def _run_query(conn, sql_text: str, params: Optional[List[Any]] = None) -> Tuple[List[str], List[tuple]]:
+    """Blocking: execute on a pooled connection, return (columns, rows)."""
+    with conn.cursor() as cur:
+        cur.execute(sql_text, params)
+        cols = [d[0] for d in cur.description]
+        return cols, cur.fetchall()
+
+
+def _run_query_arrow(conn, sql_text: str, params: Optional[List[Any]], limit: int) -> pa.Table:
+    """
+    Blocking: like `_run_query`, but fetch columnar (no per-row Python objects).
+    `limit` is the query's LIMIT: the whole page comes back as ONE Arrow
+    batch (arraysize = limit) instead of the driver's default-size chunks.
+    """
+    size = max(limit, 1)
+    with conn.cursor(arraysize=size) as cur:
+        cur.execute(sql_text, params)
+        return cur.fetchmany_arrow(size)
+
+
+def _open_cursor(conn, sql_text: str, params: Optional[List[Any]], arraysize: int):
+    """Blocking: execute and return the open cursor (caller must close it)."""
+    cur = conn.cursor(arraysize=arraysize)
+    try:
+        cur.execute(sql_text, params)
+    except:
+        cur.close()
+        raise
+    return cur
+
+
+class _ConnectionPool:
+    """
+    Bounded pool of open dbsql connections for ONE (host, http_path, token).
+    - At most `max_size` connections are handed out at once
+    - A connection that raised while in use is closed, not returned
+    - Idle connections older than `POOL_IDLE_MAX_S` are closed by `ping_idle`
+    """
+
+    def __init__(self, hostname: str, http_path: str, token: str, max_size: int = POOL_MAX_SIZE):
+        self._connect_kwargs = {
+            "server_hostname": hostname,
+            "http_path": http_path,
+            "access_token": token,
+        }
+        # (connection, monotonic time it went idle)
+        self._idle: asyncio.Queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(max_size)
+        # acquirers waiting for a slot, connecting, or holding a connection
+        self.active = 0
+
+    def _connect(self):
+        return dbsql.connect(**self._connect_kwargs)
+
+    def _put_idle(self, conn, since: Optional[float] = None) -> None:
+        self._idle.put_nowait((conn, asyncio.get_running_loop().time() if since is None else since))
+
+    @property
+    def idle(self) -> int:
+        return self._idle.qsize()
+
+    @property
+    def unused(self) -> bool:
+        return self.active == 0 and self._idle.empty()
+
+    async def fill(self, n: int) -> None:
+        """Pre-open connections until `n` are idle."""
+        while self._idle.qsize() < n:
+            self._put_idle(await _in_sql_thread(self._connect))
+
+    async def get(self):
+        """Take a connection (waits for a slot); hand it back with `put`."""
+        # counted from the start, so the pinger never drops a pool that
+        # someone is about to use (or is still connecting for)
+        self.active += 1
+        try:
+            await self._slots.acquire()
+            try:
+                try:
+                    conn, _ = self._idle.get_nowait()
+                except asyncio.QueueEmpty:
+                    conn = await _in_sql_thread(self._connect)
+            except BaseException:
+                self._slots.release()
+                raise
+        except BaseException:
+            self.active -= 1
+            raise
+        return conn
+
+    async def put(self, conn, ok: bool = True) -> None:
+        """Return a connection from `get`; `ok=False` closes it instead."""
+        try:
+            if ok:
+                self._put_idle(conn)
+            else:
+                await _in_sql_thread(_close_quietly, conn)
+        finally:
+            self._slots.release()
+            self.active -= 1
+
+    @asynccontextmanager
+    async def acquire(self):
+        conn = await self.get()
+        ok = False
+        try:
+            yield conn
+            ok = True
+        finally:
+            await self.put(conn, ok)
+
+    @staticmethod
+    async def _alive(conn) -> bool:
+        try:
+            await _in_sql_thread(_run_query, conn, "SELECT 1")
+            return True
+        except Exception:
+            return False
+
+    async def ping_idle(self) -> int:
+        """
+        Close idle connections older than `POOL_IDLE_MAX_S`; `SELECT 1` on
+        the rest and evict the ones that fail. Returns how many were closed.
+        """
+        evicted = 0
+        now = asyncio.get_running_loop().time()
+        for _ in range(self._idle.qsize()):
+            try:
+                conn, since = self._idle.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            if now - since > POOL_IDLE_MAX_S or not await self._alive(conn):
+                await _in_sql_thread(_close_quietly, conn)
+                evicted += 1
+                continue
+            self._put_idle(conn, since)
+        return evicted
+
+    def close(self) -> None:
+        while not self._idle.empty():
+            conn, _ = self._idle.get_nowait()
+            _close_quietly(conn)
+
+
+# One pool per (hostname, http_path, sha256(token)) — OBO tokens are per
+# user, so users never share a warehouse session.
+_POOLS: Dict[Tuple[str, str, str], _ConnectionPool] = {}
+
+
+def _token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _pool(hostname: str, http_path: str, token: str) -> _ConnectionPool:
+    """
+    Look up (or create) the pool for this token. Call `get`/`acquire` on it
+    right away: a reference held across an await (e.g. while queued on
+    `_SQL_SEM`) isn't counted in `active`, and the pinger may drop the pool.
+    """
+    key = (hostname, http_path, _token_hash(token))
+    pool = _POOLS.get(key)
+    if pool is None:
+        pool = _POOLS[key] = _ConnectionPool(hostname, http_path, token)
+    return pool
+
+
+async def _ping_pools_forever() -> None:
+    """Background task: health-check / age out idle connections, drop unused pools."""
+    while True:
+        await asyncio.sleep(POOL_PING_INTERVAL_S)
+        for key, pool in list(_POOLS.items()):
+            evicted = await pool.ping_idle()
+            if evicted:
+                logger.info("sql pool evicted=%d idle=%d active=%d", evicted, pool.idle, pool.active)
+            # e.g. expired OBO token / user gone quiet: nothing left to reuse.
+            # No await between the check and the pop, and callers go from
+            # `_pool()` to `get()` without awaiting, so no acquirer can slip in.
+            if pool.unused:
+                _POOLS.pop(key, None)
+
+
+@app.on_event("startup")
+async def _start_sql_pool():
+    # Only the local PAT is known up front; OBO pools fill on first use.
+    token = os.getenv("DATABRICKS_TOKEN")
+    if token:
+        try:
+            cfg = app.state.databricks
+            await _pool(cfg.hostname, cfg.http_path, token).fill(POOL_MIN_SIZE)
+        except Exception as e:
+            logger.warning("sql pool pre-warm failed: %s", e)
+    app.state.sql_pool_pinger = asyncio.create_task(_ping_pools_forever())
+
+
+@app.on_event("shutdown")
+async def _stop_sql_pool():
+    app.state.sql_pool_pinger.cancel()
+    for pool in _POOLS.values():
+        pool.close()
+    _POOLS.clear()
+    _EXECUTOR.shutdown(wait=False)
+
 #==================================================================
 # DEBUG ROUTES
 #==================================================================
@@ -166,6 +568,10 @@ async def debug_env(request: Request):
             "email": request.headers.get("X-Forwarded-Email"),
             "scopes_hint": request.headers.get("X-Forwarded-Scopes") or None,  # may be empty
         },
+        "sql_concurrency": {
+            "max": DBSQL_MAX_CONCURRENCY,
+            "free": _SQL_SEM._value,
+        },
     }
 
 # Wrap a function to always return detailed JSON on errors
@@ -188,46 +594,43 @@ async def index():
 async def me(req: Request):
     """
     Returns the **current user**, both in:
-    - Local mode (via PAT and WorkspaceClient)
+    - Local mode (via PAT)
     - App mode (via OBO token forwarded from Databricks Apps)
+    Same async REST call either way, through the shared HTTP client.
     """
     t = _token(req)
-    host = _host()
-
-    # App mode: call REST with OBO token (user's identity)
-    if t["mode"] == "app":
-        me = await _get_json(host, t["token"], "/api/2.0/preview/scim/v2/Me") \
-          or await _get_json(host, t["token"], "/api/2.0/preview/iam/current-user")
-        return {"mode": "app", "current_user": me}
-
-    # Local mode: workspace SDK with PAT
-    if not t["token"]:
+    if t["mode"] == "local" and not t["token"]:
         raise HTTPException(401, "No local PAT set (DATABRICKS_TOKEN).")
-    w = WorkspaceClient(config=Config(host=host, token=t["token"]))
-    me = w.current_user.me()
-    return {"mode": "local", "current_user": me.as_dict()}
+
+    try:
+        me = await _current_user(app.state.databricks.host_url, t["token"])
+    except httpx.TimeoutException as e:
+        return JSONResponse({
+            "mode": t["mode"],
+            "error": f"Timed out resolving current user: {e!r}",
+            "context": {"paths": list(ME_PATHS)},
+        }, status_code=504)
+    return {"mode": t["mode"], "current_user": me}
 
 
 @app.get("/api/sql/ping")
 async def sql_ping(req: Request):
     """Tiny health check to verify SQL Warehouse connectivity."""
     t = _token(req)
-    try:
-        host, http_path = _host(), _http_path()
+    if not t["token"]:
+        raise HTTPException(401, detail=f"Missing token ({t['mode']}).")
 
+    cfg = app.state.databricks
+    try:
         import time
         t0 = time.perf_counter()
-        with dbsql.connect(
-            server_hostname=host.replace("https://","").replace("http://",""),
-            http_path=http_path,
-            access_token=t["token"],
-        ) as conn, conn.cursor() as cur:
-            cur.execute("SELECT 1")
-            ok = (cur.fetchone()[0] == 1)
+        async with _pool(cfg.hostname, cfg.http_path, t["token"]).acquire() as conn:
+            _, raw_rows = await _in_sql_thread(_run_query, conn, "SELECT 1")
+            ok = (raw_rows[0][0] == 1)
         t1 = time.perf_counter()
 
         # server-side log
-        print(f"[DEBUG] /api/sql/ping ok={ok} query_ms={(t1 - t0)*1000:.1f} mode={t['mode']}")
+        logger.info("/api/sql/ping ok=%s query_ms=%.1f mode=%s", ok, (t1 - t0)*1000, t["mode"])
 
         return {"mode": t["mode"], "ok": ok, "timing": {"query_ms": round((t1 - t0)*1000, 1)}}
 
@@ -237,8 +640,8 @@ async def sql_ping(req: Request):
             "mode": t.get("mode"),
             "error": str(e),
             "context": {
-                "server_hostname": (os.getenv("DATABRICKS_HOST") or "").replace("https://","").replace("http://",""),
-                "http_path": os.getenv("DATABRICKS_SQL_HTTP_PATH") or os.getenv("DATABRICKS_HTTP_PATH"),
+                "server_hostname": cfg.hostname,
+                "http_path": cfg.http_path,
                 "has_token": bool(t.get("token")),
             },
         }, status_code=500)
@@ -249,125 +652,407 @@ async def sql_ping(req: Request):
 MAX_ROWS = 200000
 DEFAULT_LIMIT = 1000
 MAX_BYTES = 100_000_000  # Prevent single-response browser meltdown
+STREAM_BATCH_ROWS = 10_000
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+# Short-lived cache of encoded /api/emails bodies, so polling / re-paging
+# with the same filters doesn't re-run the SELECT. Keyed by token hash —
+# users never see each other's (OBO-scoped) rows. Only touched from the
+# event loop thread, so no lock needed.
+# Bounded by body BYTES (not entries — one page can be several MB); bodies
+# over EMAILS_CACHE_MAX_ENTRY_BYTES aren't cached, so one huge page can't
+# flush everyone else's.
+EMAILS_CACHE_TTL_S = 5
+EMAILS_CACHE_MAX_BYTES = int(os.getenv("EMAILS_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+EMAILS_CACHE_MAX_ENTRY_BYTES = EMAILS_CACHE_MAX_BYTES // 8
+_EMAILS_CACHE: TTLCache = TTLCache(
+    maxsize=EMAILS_CACHE_MAX_BYTES,
+    ttl=EMAILS_CACHE_TTL_S,
+    getsizeof=lambda v: len(v[1]),  # (etag, body, media_type, headers)
+)
+
+EMAIL_COLUMNS = (
+    "email_id",
+    "thread_id",
+    "subject",
+    "from_name",
+    "from_email",
+    "to_recipients",
+    "cc_recipients",
+    "sent_at",
+    "received_at",
+    "received_date",
+    "snippet",
+    "labels",
+    "is_read",
+    "is_starred",
+    "has_attachments",
+    "attachments",
+    "message_size_bytes",
+    "created_at",
+)
+
+# What a list view needs — the default projection. `fields` REPLACES it
+# (it doesn't add to it), so the bulky columns (recipients, labels,
+# attachments, snippet…) come back only when listed there.
+DEFAULT_EMAIL_FIELDS = frozenset((
+    "email_id",
+    "subject",
+    "from_name",
+    "from_email",
+    "received_at",
+    "is_read",
+    "is_starred",
+    "has_attachments",
+))
+# Always selected: the keyset cursor is built from them.
+CURSOR_FIELDS = frozenset(("email_id", "received_at"))
+SNIPPET_MAX_CHARS = 200
+
+# Column → SELECT expression, where it isn't just the column name
+_EMAIL_SELECT_EXPR = {
+    "snippet": f"substring(snippet, 1, {SNIPPET_MAX_CHARS}) AS snippet",
+}
+
+# Optional filters, in the order of the `_emails_sql` `active` flags:
+# (subject, from_email, is_read, is_starred, after)
+# `after` is the keyset seek: rows strictly past the previous page's last
+# (received_at, email_id), matching the ORDER BY below.
+EMAIL_FILTERS = (
+    "upper(subject) LIKE upper(?)",
+    "upper(from_email) LIKE upper(?)",
+    "is_read = ?",
+    "is_starred = ?",
+    "(received_at < CAST(? AS TIMESTAMP) OR (received_at = CAST(? AS TIMESTAMP) AND email_id < ?))",
+)
+
+
+def _email_columns(fields: str) -> Tuple[str, ...]:
+    """`fields` query param → whitelisted columns, in EMAIL_COLUMNS order."""
+    requested = {f.strip() for f in fields.split(",")} & set(EMAIL_COLUMNS) or DEFAULT_EMAIL_FIELDS
+    requested = requested | CURSOR_FIELDS
+    return tuple(c for c in EMAIL_COLUMNS if c in requested)
+
+
+# Built once per (projection, filter combination): no SQL assembly on repeat
+# requests, and identical text per combination so the warehouse can reuse
+# its plan.
+@functools.lru_cache(maxsize=256)
+def _emails_sql(columns: Tuple[str, ...], active: Tuple[bool, ...]) -> str:
+    where_clauses = [c for c, on in zip(EMAIL_FILTERS, active) if on]
+    where_sql = f"WHERE {' AND '.join(where_clauses)}" if where_clauses else ""
+    return "\n".join(filter(None, [
+        "SELECT",
+        ",\n".join(f"    {_EMAIL_SELECT_EXPR.get(c, c)}" for c in columns),
+        "FROM dev.core.emails",
+        where_sql,
+        "ORDER BY received_at DESC, email_id DESC",
+        "LIMIT ? OFFSET ?",
+    ]))
+
 
 import time
-from fastapi import Request, Query, HTTPException
+from fastapi import Request, HTTPException
 from fastapi.responses import JSONResponse
 
 
 
 
+class _SQLStream:
+    """
+    An executed cursor plus what it holds — a `_SQL_SEM` slot and a pooled
+    connection. `release` hands everything back, exactly once.
+    """
+
+    def __init__(self, pool: _ConnectionPool, conn, cur):
+        self.pool, self.conn, self.cur = pool, conn, cur
+        self._released = False
+
+    @classmethod
+    async def open(cls, cfg, token: str, sql_text: str, params: List[Any]) -> "_SQLStream":
+        """Run the query NOW, so setup errors surface before any response is sent."""
+        await _SQL_SEM.acquire()
+        try:
+            # resolve the pool only once the slot is ours — see `_pool`
+            pool = _pool(cfg.hostname, cfg.http_path, token)
+            conn = await pool.get()
+            try:
+                cur = await _in_sql_thread(_open_cursor, conn, sql_text, params, STREAM_BATCH_ROWS)
+            except BaseException:
+                await pool.put(conn, ok=False)
+                raise
+        except BaseException:
+            _SQL_SEM.release()
+            raise
+        return cls(pool, conn, cur)
+
+    async def release(self, ok: bool) -> None:
+        if self._released:
+            return
+        self._released = True
+        try:
+            await _in_sql_thread(_close_quietly, self.cur)
+            await self.pool.put(self.conn, ok)
+        finally:
+            _SQL_SEM.release()
+
+
+async def _ndjson_rows(stream: _SQLStream):
+    """
+    Yield NDJSON (one row per line), one Arrow batch at a time, so the
+    warehouse fetch overlaps with sending bytes to the client.
+    The query already ran (`_SQLStream.open`); errors while fetching can
+    only truncate the stream — use `format=json` to see them.
+    """
+    ok = False
+    try:
+        while True:
+            batch = await _in_sql_thread(stream.cur.fetchmany_arrow, STREAM_BATCH_ROWS)
+            if batch.num_rows == 0:
+                break
+            yield b"".join(dumps(r) + b"\n" for r in batch.to_pylist())
+        ok = True
+    finally:
+        await stream.release(ok)
+
+
+class _SQLStreamingResponse(StreamingResponse):
+    """StreamingResponse that releases its `_SQLStream` even if the body never started."""
+
+    def __init__(self, stream: _SQLStream, **kwargs):
+        super().__init__(_ndjson_rows(stream), **kwargs)
+        self._stream = stream
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            # no-op if `_ndjson_rows` already released it
+            await self._stream.release(ok=False)
+
+
+def _encode_cursor(received_at: datetime.datetime, email_id: str) -> str:
+    raw = f"{received_at.isoformat()}|{email_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> Tuple[str, str]:
+    """`after` → (received_at ISO string, email_id); HTTP 400 if malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        received_at, email_id = raw.split("|", 1)
+        datetime.datetime.fromisoformat(received_at)
+    except Exception:
+        raise HTTPException(400, detail="Query param 'after' is not a valid cursor.")
+    return received_at, email_id
+
+
+def _next_cursor(tbl: pa.Table, limit: int) -> Optional[str]:
+    """
+    Cursor for the page after `tbl`, or None if this was the last page.
+    Rows with NULL received_at sort last and can't be seeked past — paging
+    stops there (use offset to reach them).
+    """
+    if limit == 0 or tbl.num_rows < limit:
+        return None
+    received_at = tbl.column("received_at")[-1].as_py()
+    if received_at is None:
+        return None
+    return _encode_cursor(received_at, tbl.column("email_id")[-1].as_py())
+
+
+def _arrow_ipc(tbl: pa.Table) -> bytes:
+    """Arrow table → IPC stream bytes (`pyarrow.ipc.open_stream` / `polars.read_ipc_stream`)."""
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, tbl.schema) as writer:
+        writer.write_table(tbl)
+    return sink.getvalue().to_pybytes()
+
+
+# Hand-rolled query parsing for the hot endpoint (skips FastAPI/Pydantic
+# per-request validation). Same spellings Pydantic accepts for bools.
+_TRUE = frozenset(("1", "true", "t", "yes", "y", "on"))
+_FALSE = frozenset(("0", "false", "f", "no", "n", "off"))
+EMAIL_FORMATS = frozenset(("json", "ndjson", "arrow"))
+
+
+def _qp_bool(qp, name: str) -> Optional[bool]:
+    v = qp.get(name)
+    if v is None:
+        return None
+    v = v.strip().lower()
+    if v in _TRUE:
+        return True
+    if v in _FALSE:
+        return False
+    raise HTTPException(400, detail=f"Query param '{name}' must be a boolean.")
+
+
+def _qp_int(qp, name: str, default: int) -> int:
+    try:
+        return int(qp.get(name, default))
+    except ValueError:
+        raise HTTPException(400, detail=f"Query param '{name}' must be an integer.")
+
+
+def _etag_matches(req: Request, etag: str) -> bool:
+    """If-None-Match check (weak comparison, as RFC 9110 asks for GET)."""
+    inm = req.headers.get("if-none-match")
+    if not inm:
+        return False
+    if inm.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in inm.split(","))
+
+
+def _emails_response(req: Request, body: bytes, media_type: str, etag: str, headers: Dict[str, str], cache_status: str) -> Response:
+    headers = {
+        **headers,
+        "ETag": etag,
+        "Cache-Control": f"private, max-age={EMAILS_CACHE_TTL_S}",
+        "X-Cache": cache_status,
+    }
+    # Client already has these exact bytes: send no body at all
+    if _etag_matches(req, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type=media_type, headers=headers)
+
+
 @app.get("/api/emails")
-async def get_emails(
-    req: Request,
-    subject: str = Query(default=""),        # case-insensitive LIKE on subject
-    from_email: str = Query(default=""),     # case-insensitive LIKE on from_email
-    is_read: Optional[bool] = Query(default=None),  # filter by read status
-    is_starred: Optional[bool] = Query(default=None),  # filter by starred status
-    limit: int = Query(default=100, le=1000),  # max 1000 rows per request
-    offset: int = Query(default=0, ge=0),    # pagination offset
-):
+async def get_emails(req: Request):
     """
     Returns emails from dev.core.emails table with optional filters.
-    Supports pagination via limit/offset.
+    Supports keyset pagination: pass the previous response's `next_cursor`
+    as `after` (each page costs O(limit)). limit/offset still works but is
+    deprecated for deep paging — the warehouse sorts and discards `offset` rows.
+    `format=ndjson` streams bare rows, one JSON object per line.
+    `format=arrow` returns the rows as an Arrow IPC stream (for notebooks /
+    pandas / polars) — no per-row JSON work on either side.
+
+    Query params:
+    - fields: comma-separated columns to return (unknown names ignored);
+      default is a listing subset, email_id + received_at always included,
+      snippet truncated to 200 chars
+    - subject, from_email: case-insensitive LIKE filters
+    - is_read, is_starred: boolean filters
+    - limit: rows per request, clamped to 0..1000 (default 100)
+    - after: opaque cursor from `next_cursor` (arrow: `X-Next-Cursor` header;
+      not available for ndjson)
+    - offset: pagination offset, >= 0 (deprecated, prefer `after`)
+    - format: json (default) | ndjson | arrow
     """
+    qp = req.query_params
+    subject = qp.get("subject", "")
+    from_email = qp.get("from_email", "")
+    is_read = _qp_bool(qp, "is_read")
+    is_starred = _qp_bool(qp, "is_starred")
+    limit = max(min(_qp_int(qp, "limit", 100), 1000), 0)
+    offset = max(_qp_int(qp, "offset", 0), 0)
+    after = _decode_cursor(qp["after"]) if qp.get("after") else None
+    columns = _email_columns(qp.get("fields", ""))
+    fmt = qp.get("format", "json")
+    if fmt not in EMAIL_FORMATS:
+        raise HTTPException(400, detail=f"Query param 'format' must be one of {sorted(EMAIL_FORMATS)}.")
+
     # --- resolve auth/config (local PAT or App OBO) ---
     t = _token(req)
     if not t["token"]:
         raise HTTPException(401, detail=f"Missing token ({t['mode']}).")
 
+    cfg = app.state.databricks
     try:
-        host = _host()
-        http_path = _http_path()
-
-        # --- WHERE + params ---
-        where_clauses: List[str] = []
+        # --- pick the prebuilt SQL variant + params ---
+        subject, from_email = subject.strip(), from_email.strip()
+        sql_text = _emails_sql(columns, (bool(subject), bool(from_email), is_read is not None, is_starred is not None, after is not None))
         params: List[Any] = []
 
-        if subject.strip():
-            where_clauses.append("upper(subject) LIKE upper(?)")
-            params.append(f"%{subject.strip()}%")
+        if subject:
+            params.append(f"%{subject}%")
 
-        if from_email.strip():
-            where_clauses.append("upper(from_email) LIKE upper(?)")
-            params.append(f"%{from_email.strip()}%")
+        if from_email:
+            params.append(f"%{from_email}%")
 
         if is_read is not None:
-            where_clauses.append("is_read = ?")
             params.append(is_read)
 
         if is_starred is not None:
-            where_clauses.append("is_starred = ?")
             params.append(is_starred)
 
-        where_sql = f"WHERE {' AND '.join(where_clauses)}" if where_clauses else ""
-
-        sql_text = f"""
-            SELECT
-                email_id,
-                thread_id,
-                subject,
-                from_name,
-                from_email,
-                to_recipients,
-                cc_recipients,
-                sent_at,
-                received_at,
-                received_date,
-                snippet,
-                labels,
-                is_read,
-                is_starred,
-                has_attachments,
-                attachments,
-                message_size_bytes,
-                created_at
-            FROM dev.core.emails
-            {where_sql}
-            ORDER BY received_at DESC
-            LIMIT ? OFFSET ?
-        """.strip()
+        if after is not None:
+            after_received_at, after_email_id = after
+            params.extend([after_received_at, after_received_at, after_email_id])
 
         # Add limit and offset to params
         params.extend([limit, offset])
 
+        if fmt == "ndjson":
+            stream = await _SQLStream.open(cfg, t["token"], sql_text, params)
+            return _SQLStreamingResponse(stream, media_type="application/x-ndjson")
+
+        cache_key = (sql_text, tuple(params), fmt, _token_hash(t["token"]))
+        cached = _EMAILS_CACHE.get(cache_key)
+        if cached is not None:
+            etag, body, media_type, headers = cached
+            return _emails_response(req, body, media_type, etag, headers, "HIT")
+
         # --- execute + timing ---
         import time
         t0 = time.perf_counter()
-        with dbsql.connect(
-            server_hostname=host.replace("https://", "").replace("http://", ""),
-            http_path=http_path,
-            access_token=t["token"],
-        ) as conn, conn.cursor() as cur:
-            cur.execute(sql_text, params)
-            cols = [d[0] for d in cur.description]
-            raw_rows = cur.fetchall()
+        async with _SQL_SEM, _pool(cfg.hostname, cfg.http_path, t["token"]).acquire() as conn:
+            arrow_tbl = await _in_sql_thread(_run_query_arrow, conn, sql_text, params, limit)
         t1 = time.perf_counter()
 
         # --- serialize + timing ---
+        # Encode rows once here (so `serialize_ms` is the real cost) and embed
+        # the bytes as-is — the outer payload render doesn't touch them again.
         t2 = time.perf_counter()
-        rows = [{cols[i]: to_jsonable(v) for i, v in enumerate(r)} for r in raw_rows]
+        count = arrow_tbl.num_rows
+        next_cursor = _next_cursor(arrow_tbl, limit)
+        if fmt == "arrow":
+            body = _arrow_ipc(arrow_tbl)
+        else:
+            rows_bytes = dumps(arrow_tbl.to_pylist())
+            rows_json = orjson.Fragment(rows_bytes)
         t3 = time.perf_counter()
 
-        print(
-            "[DEBUG] /api/emails "
-            f"rows={len(rows)} query_ms={(t1 - t0)*1000:.1f} json_ms={(t3 - t2)*1000:.1f} "
-            f"mode={t['mode']} limit={limit} offset={offset}"
+        logger.info(
+            "/api/emails rows=%d query_ms=%.1f json_ms=%.1f mode=%s limit=%d offset=%d format=%s",
+            count, (t1 - t0)*1000, (t3 - t2)*1000, t["mode"], limit, offset, fmt,
         )
 
-        return JSONResponse({
-            "mode": t["mode"],
-            "rows": rows,
-            "count": len(rows),
-            "limit": limit,
-            "offset": offset,
-            "timing": {
-                "query_ms": round((t1 - t0) * 1000, 1),
-                "serialize_ms": round((t3 - t2) * 1000, 1),
-                "total_ms": round((t3 - t0) * 1000, 1),
-            },
-            "sql": {"text": sql_text, "params": params},
-        })
+        headers: Dict[str, str] = {}
+        if fmt == "arrow":
+            media_type = ARROW_STREAM_MEDIA_TYPE
+            if next_cursor:
+                headers["X-Next-Cursor"] = next_cursor
+        else:
+            media_type = "application/json"
+            body = dumps({
+                "mode": t["mode"],
+                "rows": rows_json,
+                "count": count,
+                "limit": limit,
+                "offset": offset,
+                "next_cursor": next_cursor,
+                "timing": {
+                    "query_ms": round((t1 - t0) * 1000, 1),
+                    "serialize_ms": round((t3 - t2) * 1000, 1),
+                    "total_ms": round((t3 - t0) * 1000, 1),
+                },
+                "sql": {"text": sql_text, "params": params},
+            })
+
+        # ETag over the DATA (JSON rows + cursor, or the Arrow bytes) — not the
+        # per-request timing in the JSON envelope — so an unchanged page still
+        # matches after the server cache entry expires.
+        etag_src = body if fmt == "arrow" else rows_bytes + (next_cursor or "").encode()
+        # Weak (W/): computed before compression, so the zstd / br / gzip
+        # representations share it — a strong ETag must differ per coding.
+        etag = 'W/"' + hashlib.blake2b(etag_src, digest_size=16).hexdigest() + '"'
+        if len(body) <= EMAILS_CACHE_MAX_ENTRY_BYTES:
+            _EMAILS_CACHE[cache_key] = (etag, body, media_type, headers)
+        return _emails_response(req, body, media_type, etag, headers, "MISS")
 
     except Exception as e:
         # rich JSON error with context so you see the *real* reason in-app
@@ -376,8 +1061,8 @@ async def get_emails(
             "error": str(e),
             "sql": {"text": sql_text if 'sql_text' in locals() else None, "params": params if 'params' in locals() else None},
             "context": {
-                "server_hostname": (os.getenv("DATABRICKS_HOST") or "").replace("https://","").replace("http://",""),
-                "http_path": os.getenv("DATABRICKS_SQL_HTTP_PATH") or os.getenv("DATABRICKS_HTTP_PATH"),
+                "server_hostname": cfg.hostname,
+                "http_path": cfg.http_path,
                 "has_token": bool(t.get("token")),
             },
         }, status_code=500)
@@ -73,6 +73,9 @@ TBLPROPERTIES (
 -- ALTER TABLE gmail_emails ADD CONSTRAINT email_id_not_null CHECK (email_id IS NOT NULL) NOT ENFORCED;
 
 -- Suggested upsert key for ingestion from Gmail API: email_id
+-- Delta has no secondary indexes. To keep the app's keyset paging
+-- (ORDER BY received_at DESC, email_id DESC) data-skipping friendly:
+-- OPTIMIZE dev.core.emails ZORDER BY (received_at, email_id);
 -- Suggested dedupe key within a thread: (thread_id, email_id)
 
 -- Insert 3 dummy rows for testing